@@ -1,4 +1,12 @@
+from datetime import timedelta
+
 import requests
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from pretix.base.models import OrderPayment
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from .ifthenpayexception import IfThenPayException
 from ..models import MBWAYIfThenPayObject
 
@@ -6,6 +14,12 @@ MBWAY_ENTRYPOINT = 'https://mbway.ifthenpay.com/IfthenPayMBW.asmx'
 REQUIRE_PAYMENT_ENDPOINT = '/SetPedidoJSON'
 REQUIRE_STATE_ENDPOINT = '/EstadoPedidosJSON'
 
+_REQUIRE_PAYMENT_URL = MBWAY_ENTRYPOINT + REQUIRE_PAYMENT_ENDPOINT
+_REQUIRE_STATE_URL = MBWAY_ENTRYPOINT + REQUIRE_STATE_ENDPOINT
+
+PENDING_POLL_WINDOW = timedelta(days=1)
+STATE_BATCH_SIZE = 50  # ids per EstadoPedidosJSON request
+
 STATE_PAID = '000'
 STATE_CANCELLED = '020'
 STATE_PENDING = '123'       # TODO it is also the state if user does not interact and it expires (there is no difference in pending and expired)
@@ -14,6 +28,18 @@ _content_type_header = {
     'Content-type': 'application/x-www-form-urlencoded',
 }
 
+# (connect, read) timeouts, so a hung ifthenpay connection does not block the worker forever
+_TIMEOUT = (3.05, 10)
+
+# reuse keep-alive connections to ifthenpay instead of a new TCP + TLS handshake per call
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504)),
+))
+_SESSION.headers.update(_content_type_header)
+
 
 def require_payment(mbwaykey, canal, referencia, descricao, valor, telemovel, email=''):
     content = {
@@ -25,55 +51,79 @@ def require_payment(mbwaykey, canal, referencia, descricao, valor, telemovel, em
         'email': email,
         'descricao': descricao,
     }
-    result = requests.post(MBWAY_ENTRYPOINT + REQUIRE_PAYMENT_ENDPOINT, headers=_content_type_header, data=content)
-
-    request_accepted(result)  # raises exception if not accepted
+    result = _SESSION.post(_REQUIRE_PAYMENT_URL, data=content, timeout=_TIMEOUT)
 
-    return result
+    return request_accepted(result)  # raises exception if not accepted
 
 
 def request_accepted(result):
     if result.status_code != 200:
-        raise IfThenPayException('MBWay payment failed with status ' + result.status_code)
-    elif result.json()['Estado'] != '000':
-        raise IfThenPayException('MBWay payment failed with \'Estado\' ' + result.json()['Estado'])
-    return True
-
-
-payment_required = request_accepted
-
-
-def create_order(result, mbwaykey, canal, payment):
-    return MBWAYIfThenPayObject.objects.create(
-        orderID=result.json().get('IdPedido'),
-        mbway_key=mbwaykey,
-        channel=canal,
-        order=payment.order,
-        payment=payment,
-    )
-
-
-def require_payment_state(mbwaykey, canal, idpedido):
+        raise IfThenPayException(f'MBWay payment failed with status {result.status_code}')
+    data = result.json()
+    if data['Estado'] != '000':
+        raise IfThenPayException('MBWay payment failed with \'Estado\' ' + data['Estado'])
+    return data
+
+
+def create_order(data, mbwaykey, canal, payment):
+    # IdPedido is fresh from ifthenpay, so the row only exists already when a request is retried
+    try:
+        with transaction.atomic():
+            return MBWAYIfThenPayObject.objects.create(
+                orderID=data.get('IdPedido'),
+                mbway_key=mbwaykey,
+                channel=canal,
+                order=payment.order,
+                payment=payment,
+            )
+    except IntegrityError:
+        return MBWAYIfThenPayObject.objects.get(orderID=data.get('IdPedido'))
+
+
+def require_payment_state(mbwaykey, canal, idpedidos):
+    # ifthenpay accepts a comma separated list of ids, so all orders of one account are checked in a single request
     content = {
         'MbWayKey': mbwaykey,
         'Canal': canal,
-        'idspagamento': idpedido,
+        'idspagamento': ','.join(idpedidos),
     }
 
-    result = requests.post(MBWAY_ENTRYPOINT + REQUIRE_STATE_ENDPOINT, headers=_content_type_header, data=content)
-    print(result.json())
+    result = _SESSION.post(_REQUIRE_STATE_URL, data=content, timeout=_TIMEOUT)
 
     if result.status_code == 200:
         res_json = result.json()
         if res_json['Estado'] == '000':
-            return res_json['EstadoPedidos'][0]['Estado']
+            return {row['IdPedido']: row['Estado'] for row in res_json['EstadoPedidos']}
+
+    return {}  # orders ifthenpay did not report on are left out
 
-    return ''
 
+def update_payment_state(payment, state):
+    # retried webhooks and polls report the same state again; only act on an actual transition
+    if state == STATE_PAID and payment.state != OrderPayment.PAYMENT_STATE_CONFIRMED:
+        payment.confirm(force=True)
+    elif state == STATE_CANCELLED and payment.state != OrderPayment.PAYMENT_STATE_FAILED:
+        payment.fail()
 
-def get_order_by_id(idpedido):
-    return MBWAYIfThenPayObject.objects.get(orderID=idpedido)
 
+def get_order_by_id(idpedido, lock=False):
+    qs = MBWAYIfThenPayObject.objects.select_related('payment', 'payment__order', 'payment__order__event').only(
+        'orderID', 'mbway_key', 'channel', 'payment'
+    )
+    if lock:
+        # payment is nullable (outer join), so only our own row can be locked; rows held by another delivery are skipped
+        qs = qs.select_for_update(skip_locked=True, of=('self',))
+    return qs.get(orderID=idpedido)
+
+
+def get_order_id_by_payment(payment):
+    # a retried payment can have several ifthenpay orders; the latest one is the live one
+    return MBWAYIfThenPayObject.objects.filter(payment=payment).order_by('-pk').values_list('orderID', flat=True).first()
 
-def get_order_by_payment(payment):
-    return MBWAYIfThenPayObject.objects.get(payment=payment)  # TODO test
+
+def get_pending_objects():
+    # ifthenpay keeps reporting expired requests as pending, so only recent payments are worth asking about
+    return MBWAYIfThenPayObject.objects.select_related('payment', 'order').filter(
+        payment__state=OrderPayment.PAYMENT_STATE_PENDING,
+        payment__created__gte=now() - PENDING_POLL_WINDOW,
+    )
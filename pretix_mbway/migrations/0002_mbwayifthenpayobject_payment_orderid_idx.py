@@ -0,0 +1,17 @@
+# Generated by Django 3.2.9 on 2026-10-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mbway', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mbwayifthenpayobject',
+            index=models.Index(fields=['payment', 'orderID'], name='mbway_payment_orderid_idx'),
+        ),
+    ]
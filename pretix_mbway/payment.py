@@ -32,8 +32,6 @@
 # distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations under the License.
 import decimal
-import json
-import requests
 import logging
 import urllib.parse
 from collections import OrderedDict
@@ -43,11 +41,14 @@ from typing import Any, Dict, Union
 from django import forms
 from django.contrib import messages
 from django.core import signing
+from django.db import transaction
 from django.http import HttpRequest
 from django.template.loader import get_template
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject, cached_property
+from django.utils.text import format_lazy
 from django.utils.timezone import now
-from django.utils.translation import gettext as __, gettext_lazy as _
+from django.utils.translation import gettext as __, get_language, gettext_lazy as _
 from i18nfield.strings import LazyI18nString
 
 from pretix.base.decimal import round_decimal
@@ -60,10 +61,22 @@ from pretix.multidomain.urlreverse import build_absolute_uri
 from .ifthenpay import mbway
 
 from .models import MBWAYIfThenPayObject
+from .tasks import require_mbway_payment
 
 logger = logging.getLogger('pretix.plugins.mbway')
 
-SUPPORTED_CURRENCIES = ['EUR']
+SUPPORTED_CURRENCIES = frozenset(('EUR',))
+
+# resolved on first use, so the template engine is not set up while apps are loading
+_TPL_CONFIRM = SimpleLazyObject(lambda: get_template('pretix_mbway/checkout_payment_confirm.html'))
+_TPL_PENDING = SimpleLazyObject(lambda: get_template('pretix_mbway/pending.html'))
+_PENDING_HTML = {}
+
+_HELP_IFTHENPAY = format_lazy(
+    _('<a target="_blank" rel="noopener" href="{docs_url}">{text}</a>'),
+    text=_('Click here for more information'),
+    docs_url='https://helpdesk.ifthenpay.com/en/support/home',
+)
 
 
 class MBWAY(BasePaymentProvider):
@@ -96,26 +109,20 @@ class MBWAY(BasePaymentProvider):
             return _('The MBWAY Plugin is being used in test mode')
         return None
 
-    @property
+    @cached_property
     def settings_form_fields(self):
         fields = [
             ('mbway_key',
              forms.CharField(
                  label=_('MBWAY Key'),
                  required=True,
-                 help_text=_('<a target="_blank" rel="noopener" href="{docs_url}">{text}</a>').format(
-                     text=_('Click here for more information'),
-                     docs_url='https://helpdesk.ifthenpay.com/en/support/home'
-                 )
+                 help_text=_HELP_IFTHENPAY,
              )),
             ('channel',
              forms.CharField(
                  label=_('Channel'),
                  required=True,
-                 help_text=_('<a target="_blank" rel="noopener" href="{docs_url}">{text}</a>').format(
-                     text=_('Click here for more information'),
-                     docs_url='https://helpdesk.ifthenpay.com/en/support/home'
-                 )
+                 help_text=_HELP_IFTHENPAY,
              )),
         ]
 
@@ -128,79 +135,98 @@ class MBWAY(BasePaymentProvider):
              )),
         ]
 
-        d = OrderedDict(
-            fields + extra_fields + list(super().settings_form_fields.items())
-        )
-
-        d.move_to_end('description')
-        d.move_to_end('_enabled', False)
-        return d
+        base_fields = dict(super().settings_form_fields)
+        return {
+            '_enabled': base_fields.pop('_enabled'),
+            **dict(fields),
+            **base_fields,
+            **dict(extra_fields),
+        }
 
     def is_allowed(self, request: HttpRequest, total: Decimal = None) -> bool:
-        return super().is_allowed(request, total) and self.event.currency in SUPPORTED_CURRENCIES
+        return self.event.currency in SUPPORTED_CURRENCIES and super().is_allowed(request, total)
 
     def payment_is_valid_session(self, request):
         return True
 
+    def _get_telemovel(self, request) -> str:
+        if not hasattr(request, '_mbway_telemovel'):
+            request._mbway_telemovel = request.session.get('telemovel', '')
+        return request._mbway_telemovel
+
     def checkout_prepare(self, request, cart):
-        try:
-            telemovel = request.POST.get('payment_mbway-telemovel')
-        except KeyError:
+        telemovel = request.POST.get('payment_mbway-telemovel', '')
+        request.session['telemovel'] = request._mbway_telemovel = telemovel
+        if telemovel == '':
             messages.error(request,'Invalid request: Missing phone number')
             return False
-        request.session['telemovel'] = telemovel
-        return request.session.get('telemovel', '') != ''
+        return True
 
     def checkout_confirm_render(self, request, order: Order = None) -> str:
-        template = get_template('pretix_mbway/checkout_payment_confirm.html')
-        ctx = {'telemovel': request.session.get('telemovel', ''),
+        ctx = {'telemovel': self._get_telemovel(request),
                'referencia': self.settings.get('description', ''),
               }
-        return template.render(ctx)
+        return _TPL_CONFIRM.render(ctx)
 
 
-    def _format_price(self, value: float):
-        return f'{value: .2f}'
+    def _format_price(self, value: Decimal) -> str:
+        return format(round_decimal(value, self.event.currency), 'f')
 
     def execute_payment(self, request: HttpRequest, payment: OrderPayment) -> str:
-        telemovel = request.session.get('telemovel', '')
+        telemovel = self._get_telemovel(request)
         if telemovel == '':
-            payment.state = payment.PAYMENT_STATE_FAILED
-            raise PaymentException(_(f'Something went wrong with the payment processing [ { request.status_code } ] : Phone number not in session'))
+            raise PaymentException(_('Phone number not in session'))
+
+        # the ifthenpay round-trip runs in a worker, so the checkout request does not wait on it;
+        # the payment is promoted to pending (or failed) from there
+        transaction.on_commit(lambda: require_mbway_payment.apply_async(args=(self.event.pk, payment.pk, telemovel)))
+        return None
 
+    def request_payment(self, payment: OrderPayment, telemovel: str):
         mbway_key = self.settings.get('mbway_key', '')
         channel = self.settings.get('channel', '')
         description = self.settings.get('description', '')
 
         amount = self._format_price(payment.amount)
 
-        result = mbway.require_payment(
+        data = mbway.require_payment(
             mbway_key,
             channel,
-            description,
+            payment.full_id,
             description,
             amount,
             telemovel,
-        )
+            payment.order.email or '',
+        )  # raises IfThenPayException if ifthenpay did not accept the request
 
-        if mbway.payment_required(result):
-            mbway.create_order(
-                result,
+        with transaction.atomic():
+            mbw_order = mbway.create_order(
+                data,
                 mbway_key,
                 channel,
                 payment
             )
-            payment.state = payment.PAYMENT_STATE_PENDING
-            payment.save()
-            return None
-
-        payment.state = payment.PAYMENT_STATE_FAILED
-        raise PaymentException(f'Something went wrong with the payment processing [ { result.status_code } ] : { result.text }')
+            payment.info_data = {'order_id': mbw_order.orderID}
+            # only two columns change, so skip the full-row save and its signal handlers;
+            # a payment canceled while ifthenpay was being asked is left alone
+            updated = OrderPayment.objects.filter(
+                pk=payment.pk, state=OrderPayment.PAYMENT_STATE_CREATED
+            ).update(state=OrderPayment.PAYMENT_STATE_PENDING, info=payment.info)
+        if updated:
+            payment.state = OrderPayment.PAYMENT_STATE_PENDING
+        else:
+            # the push already went out, but later webhooks for this payment are ignored as it is final
+            logger.warning(
+                'MBWay payment %s changed state while requesting ifthenpay order %s; it was not marked pending',
+                payment.full_id, mbw_order.orderID,
+            )
 
     def payment_pending_render(self, request, payment) -> str:
-        template = get_template('pretix_mbway/pending.html')
-        ctx = {}
-        return template.render(ctx)
+        # the context is empty, so the output only depends on the active language
+        language = get_language()
+        if language not in _PENDING_HTML:
+            _PENDING_HTML[language] = _TPL_PENDING.render({})
+        return _PENDING_HTML[language]
 
     @property
     def abort_pending_allowed(self) -> bool:
@@ -210,10 +236,25 @@ class MBWAY(BasePaymentProvider):
         return False
 
     def payment_prepare(self, request: HttpRequest, payment: OrderPayment) -> Union[bool, str]:
-        return request.session.get('telemovel', '') != ''
+        return self._get_telemovel(request) != ''
+
+    def get_order_id(self, payment: OrderPayment) -> str:
+        info = payment.info_data
+        order_id = info.get('order_id')
+        if order_id:
+            return order_id
+
+        # payments created before the id was kept in the payment info
+        order_id = mbway.get_order_id_by_payment(payment)
+        if order_id is None:
+            return ''  # ifthenpay was not (successfully) asked for this payment yet
+        info['order_id'] = order_id
+        payment.info_data = info
+        payment.save(update_fields=['info'])
+        return order_id
 
     def payment_control_render(self, request: HttpRequest, payment: OrderPayment):
-        return f'<p>IfThenPay Payment ID : { mbway.get_order_by_payment(payment).orderID } </p>'
+        return f'<p>IfThenPay Payment ID : { self.get_order_id(payment) } </p>'
 
     def payment_control_render_short(self, payment: OrderPayment) -> str:
         return f'{ self.get_order_id(payment) }: { payment.state }'
@@ -226,11 +267,11 @@ class MBWAY(BasePaymentProvider):
 
     def api_payment_details(self, payment: OrderPayment):
         return {
-            'order_id': mbway.get_order_by_payment(payment).orderID,
+            'order_id': self.get_order_id(payment),
             'description': self.settings.get('description', ''),
             'amount': payment.amount,
             'status': payment.status,
         }
 
     def matching_id(self, payment: OrderPayment):
-        return mbway.get_order_by_payment(payment).orderID
+        return self.get_order_id(payment)
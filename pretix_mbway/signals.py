@@ -19,9 +19,18 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
 # <https://www.gnu.org/licenses/>.
 #
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 from django.dispatch import receiver
+from django_scopes import scopes_disabled
+
+from pretix.base.signals import periodic_task, register_payment_providers
 
-from pretix.base.signals import register_payment_providers
+from .ifthenpay import mbway
+
+logger = logging.getLogger('pretix.plugins.mbway')
 
 
 @receiver(register_payment_providers, dispatch_uid="mbway")
@@ -29,5 +38,34 @@ def register_payment_provider(sender, **kwargs):
     from .payment import MBWAY
     return MBWAY
 
-    def ready(self):
-        from . import signals  # NOQA
+
+@receiver(periodic_task, dispatch_uid="mbway_poll_pending")
+@scopes_disabled()
+def poll_pending_payments(sender, **kwargs):
+    pending = defaultdict(list)
+    for mbw_order in mbway.get_pending_objects():
+        pending[mbw_order.mbway_key, mbw_order.channel].append(mbw_order)
+
+    # one request per account (in fixed-size batches), run concurrently over the pooled session
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            (batch, executor.submit(mbway.require_payment_state, mbway_key, channel, [o.orderID for o in batch]))
+            for (mbway_key, channel), mbw_orders in pending.items()
+            for batch in (
+                mbw_orders[i:i + mbway.STATE_BATCH_SIZE] for i in range(0, len(mbw_orders), mbway.STATE_BATCH_SIZE)
+            )
+        ]
+
+    # a failing account or payment must not hold up the others in this run
+    for mbw_orders, future in futures:
+        try:
+            states = future.result()
+        except Exception:
+            logger.exception('Could not fetch MB WAY payment states from ifthenpay')
+            continue
+
+        for mbw_order in mbw_orders:
+            try:
+                mbway.update_payment_state(mbw_order.payment, states.get(mbw_order.orderID, ''))
+            except Exception:
+                logger.exception('Could not update MB WAY payment %s', mbw_order.orderID)
@@ -0,0 +1,99 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020 Raphael Michel and contributors
+# Copyright (C) 2020-2021 rami.io GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import logging
+
+import requests
+from django.db import transaction
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Event, OrderPayment
+from pretix.base.payment import PaymentException
+from pretix.base.services.tasks import EventTask
+from pretix.celery_app import app
+from urllib3.exceptions import NewConnectionError
+
+from .ifthenpay import mbway
+from .models import MBWAYIfThenPayObject
+
+logger = logging.getLogger('pretix.plugins.mbway')
+
+FINAL_PAYMENT_STATES = (
+    OrderPayment.PAYMENT_STATE_CONFIRMED,
+    OrderPayment.PAYMENT_STATE_FAILED,
+    OrderPayment.PAYMENT_STATE_CANCELED,
+    OrderPayment.PAYMENT_STATE_REFUNDED,
+)
+
+
+def _connection_not_established(e: requests.ConnectionError) -> bool:
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None  # urllib3's MaxRetryError
+    return isinstance(reason, NewConnectionError)
+
+
+def _fail_payment(payment: OrderPayment, error: str):
+    logger.info('MBWay payment %s failed: %s', payment.full_id, error)
+    payment.refresh_from_db(fields=['state'])
+    if payment.state == OrderPayment.PAYMENT_STATE_CREATED:
+        payment.fail(info={'error': error})
+
+
+@app.task(base=EventTask, bind=True, max_retries=3)
+def require_mbway_payment(self, event: Event, payment_id: int, telemovel: str):
+    payment = OrderPayment.objects.select_related('order', 'order__event').get(pk=payment_id, order__event=event)
+    if payment.state != OrderPayment.PAYMENT_STATE_CREATED:
+        return  # already requested (redelivered task) or canceled in the meantime
+
+    try:
+        payment.payment_provider.request_payment(payment, telemovel)
+    except PaymentException as e:
+        _fail_payment(payment, str(e))
+    except requests.ConnectionError as e:
+        # SetPedidoJSON is not idempotent, so only retry when no connection was ever established;
+        # an aborted connection may have delivered the request already
+        if _connection_not_established(e) and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        _fail_payment(payment, str(e))
+    except (requests.RequestException, ValueError) as e:
+        # read timeouts or an unparsable answer: ifthenpay may have accepted it, so retrying could push twice
+        _fail_payment(payment, str(e))
+
+
+@app.task(max_retries=3, autoretry_for=(requests.RequestException,), retry_backoff=True)
+@scopes_disabled()
+def process_mbway_callback(idpedido: str):
+    with transaction.atomic():
+        try:
+            mbw_order = mbway.get_order_by_id(idpedido, lock=True)
+        except MBWAYIfThenPayObject.DoesNotExist:
+            return  # another delivery of this webhook is being processed
+
+        if mbw_order.payment.state in FINAL_PAYMENT_STATES:
+            return
+
+        state = mbway.require_payment_state(
+            mbw_order.mbway_key,
+            mbw_order.channel,
+            [mbw_order.orderID]
+        ).get(mbw_order.orderID, '')
+        mbway.update_payment_state(mbw_order.payment, state)
@@ -1,8 +1,6 @@
 import os
-from distutils.command.build import build
 
-from django.core import management
-from setuptools import find_packages, setup
+from setuptools import setup
 
 from pretix_mbway import __version__
 
@@ -16,15 +14,8 @@ except Exception:
     long_description = ""
 
 
-class CustomBuild(build):
-    def run(self):
-        management.call_command("compilemessages", verbosity=1)
-        build.run(self)
-
-
-cmdclass = {"build": CustomBuild}
-
-
+# Translations are compiled by the packager (`make localecompile`) before building the
+# sdist/wheel, and the resulting .mo files are shipped as package data.
 setup(
     name="pretix-mbway",
     version=__version__,
@@ -35,9 +26,12 @@ setup(
     author_email="mrmurilo75@gmail.com",
     license="Apache",
     install_requires=[],
-    packages=find_packages(exclude=["tests", "tests.*"]),
+    packages=[
+        "pretix_mbway",
+        "pretix_mbway.ifthenpay",
+        "pretix_mbway.migrations",
+    ],
     include_package_data=True,
-    cmdclass=cmdclass,
     entry_points="""
 [pretix.plugin]
 pretix_mbway=pretix_mbway:PretixPluginMeta
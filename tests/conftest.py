@@ -1 +1,68 @@
-# put your pytest fixtures here
+import json
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Event, Order, OrderPayment, Organizer
+from pretix_mbway.ifthenpay import mbway
+from pretix_mbway.models import MBWAYIfThenPayObject
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+@pytest.fixture
+def event():
+    with scopes_disabled():
+        organizer = Organizer.objects.create(name='Dummy', slug='dummy')
+        event = Event.objects.create(
+            organizer=organizer, name='Dummy', slug='dummy', date_from=now(),
+            plugins='pretix_mbway', currency='EUR',
+        )
+        event.settings.set('payment_mbway_mbway_key', 'ABC-123456')
+        event.settings.set('payment_mbway_channel', '03')
+        event.settings.set('payment_mbway_description', 'Tickets')
+        yield event
+
+
+@pytest.fixture
+def order(event):
+    return Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10), total=Decimal('13.37'),
+    )
+
+
+@pytest.fixture
+def mbway_payment(order):
+    def make(orderID, state=OrderPayment.PAYMENT_STATE_PENDING, mbway_key='ABC-123456', channel='03'):
+        payment = order.payments.create(provider='mbway', amount=order.total, state=state)
+        MBWAYIfThenPayObject.objects.create(
+            orderID=orderID, mbway_key=mbway_key, channel=channel, order=order, payment=payment,
+        )
+        return payment
+    return make
+
+
+@pytest.fixture
+def ifthenpay(monkeypatch):
+    # queue answers in `responses`; every request made is recorded in `calls`
+    fake = SimpleNamespace(calls=[], responses=[])
+
+    def post(url, data=None, **kwargs):
+        fake.calls.append((url, data))
+        return FakeResponse(fake.responses.pop(0))
+
+    monkeypatch.setattr(mbway._SESSION, 'post', post)
+    return fake
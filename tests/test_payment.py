@@ -0,0 +1,105 @@
+from decimal import Decimal
+
+import pytest
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.utils import translation
+from django.utils.translation import get_language
+
+from pretix_mbway import payment as payment_module
+from pretix_mbway.models import MBWAYIfThenPayObject
+from pretix_mbway.payment import MBWAY
+
+
+def _post(rf, data):
+    request = rf.post('/', data)
+    request.session = SessionStore()
+    request._messages = FallbackStorage(request)
+    return request
+
+
+@pytest.mark.django_db
+def test_get_order_id_falls_back_to_ifthenpay_order(event, mbway_payment):
+    payment = mbway_payment('P1')
+
+    assert MBWAY(event).get_order_id(payment) == 'P1'
+    payment.refresh_from_db()
+    assert payment.info_data == {'order_id': 'P1'}
+
+
+@pytest.mark.django_db
+def test_get_order_id_without_ifthenpay_order(event, order):
+    payment = order.payments.create(provider='mbway', amount=order.total)
+
+    assert MBWAY(event).get_order_id(payment) == ''
+    payment.refresh_from_db()
+    assert not payment.info
+
+
+@pytest.mark.django_db
+def test_get_order_id_prefers_latest_ifthenpay_order(event, order, mbway_payment):
+    payment = mbway_payment('P1')
+    MBWAYIfThenPayObject.objects.create(
+        orderID='P2', mbway_key='ABC-123456', channel='03', order=order, payment=payment,
+    )
+
+    assert MBWAY(event).get_order_id(payment) == 'P2'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('amount,expected', [
+    (Decimal('12.5'), '12.50'),
+    (Decimal('12.345'), '12.35'),
+    (Decimal('0'), '0.00'),
+])
+def test_format_price(event, amount, expected):
+    assert MBWAY(event)._format_price(amount) == expected
+
+
+@pytest.mark.django_db
+def test_checkout_prepare_requires_phone_number(event, rf):
+    request = _post(rf, {'payment_mbway-telemovel': ''})
+
+    assert not MBWAY(event).checkout_prepare(request, None)
+    assert request.session['telemovel'] == ''
+    assert len(list(get_messages(request))) == 1
+
+
+@pytest.mark.django_db
+def test_checkout_prepare_stores_phone_number(event, rf):
+    request = _post(rf, {'payment_mbway-telemovel': '912345678'})
+    provider = MBWAY(event)
+
+    assert provider.checkout_prepare(request, None)
+    assert request.session['telemovel'] == '912345678'
+    assert provider.payment_prepare(request, None)
+
+
+@pytest.mark.django_db
+def test_pending_render_is_cached_per_language(event, monkeypatch):
+    renders = []
+
+    class Template:
+        def render(self, ctx):
+            renders.append(get_language())
+            return f'pending-{get_language()}'
+
+    monkeypatch.setattr(payment_module, '_TPL_PENDING', Template())
+    monkeypatch.setattr(payment_module, '_PENDING_HTML', {})
+    provider = MBWAY(event)
+
+    with translation.override('en'):
+        assert provider.payment_pending_render(None, None) == 'pending-en'
+        assert provider.payment_pending_render(None, None) == 'pending-en'
+    with translation.override('de'):
+        assert provider.payment_pending_render(None, None) == 'pending-de'
+    assert renders == ['en', 'de']
+
+
+@pytest.mark.django_db
+def test_settings_form_fields_order(event):
+    fields = list(MBWAY(event).settings_form_fields)
+
+    assert fields[:3] == ['_enabled', 'mbway_key', 'channel']
+    assert fields[-1] == 'description'
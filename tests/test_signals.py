@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from pretix.base.models import OrderPayment
+from pretix_mbway.ifthenpay import mbway
+from pretix_mbway.signals import poll_pending_payments
+
+
+@pytest.mark.django_db
+def test_poll_groups_by_account(mbway_payment, monkeypatch):
+    mbway_payment('P1')
+    mbway_payment('P2')
+    mbway_payment('P3', mbway_key='DEF-654321', channel='04')
+    mbway_payment('P4', state=OrderPayment.PAYMENT_STATE_CONFIRMED)
+
+    calls = []
+    lock = threading.Lock()
+
+    def require_payment_state(mbwaykey, canal, idpedidos):
+        with lock:
+            calls.append((mbwaykey, canal, sorted(idpedidos)))
+        return {}
+
+    monkeypatch.setattr(mbway, 'require_payment_state', require_payment_state)
+
+    poll_pending_payments(sender=None)
+
+    assert sorted(calls) == [
+        ('ABC-123456', '03', ['P1', 'P2']),
+        ('DEF-654321', '04', ['P3']),
+    ]
+
+
+@pytest.mark.django_db
+def test_poll_applies_states(mbway_payment, monkeypatch):
+    paid = mbway_payment('P1')
+    cancelled = mbway_payment('P2')
+
+    monkeypatch.setattr(mbway, 'require_payment_state', lambda mbwaykey, canal, idpedidos: {
+        'P1': mbway.STATE_PAID,
+        'P2': mbway.STATE_CANCELLED,
+    })
+
+    poll_pending_payments(sender=None)
+
+    paid.refresh_from_db()
+    cancelled.refresh_from_db()
+    assert paid.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+    assert cancelled.state == OrderPayment.PAYMENT_STATE_FAILED
@@ -0,0 +1,71 @@
+from http.client import RemoteDisconnected
+
+import pytest
+import requests
+from urllib3.exceptions import ProtocolError
+
+from pretix.base.models import OrderPayment
+from pretix_mbway.ifthenpay import mbway
+from pretix_mbway.models import MBWAYIfThenPayObject
+from pretix_mbway.tasks import require_mbway_payment
+
+
+@pytest.fixture
+def payment(order):
+    return order.payments.create(provider='mbway', amount=order.total, state=OrderPayment.PAYMENT_STATE_CREATED)
+
+
+@pytest.mark.django_db
+def test_require_payment_sets_pending(ifthenpay, event, payment):
+    ifthenpay.responses.append({'Estado': '000', 'IdPedido': 'P1'})
+
+    require_mbway_payment.apply(args=(event.pk, payment.pk, '912345678')).get()
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_PENDING
+    assert payment.info_data == {'order_id': 'P1'}
+    assert MBWAYIfThenPayObject.objects.get(orderID='P1').payment == payment
+    assert ifthenpay.calls[0][1]['nrtlm'] == '912345678'
+    assert ifthenpay.calls[0][1]['valor'] == '13.37'
+
+
+@pytest.mark.django_db
+def test_require_payment_rejected_fails_payment(ifthenpay, event, payment):
+    ifthenpay.responses.append({'Estado': '100', 'IdPedido': ''})
+
+    require_mbway_payment.apply(args=(event.pk, payment.pk, '912345678')).get()
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_FAILED
+    assert not MBWAYIfThenPayObject.objects.exists()
+
+
+@pytest.mark.django_db
+def test_require_payment_redelivery_is_noop(ifthenpay, event, payment):
+    ifthenpay.responses.append({'Estado': '000', 'IdPedido': 'P1'})
+
+    require_mbway_payment.apply(args=(event.pk, payment.pk, '912345678')).get()
+    require_mbway_payment.apply(args=(event.pk, payment.pk, '912345678')).get()
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_PENDING
+    assert len(ifthenpay.calls) == 1
+    assert MBWAYIfThenPayObject.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_require_payment_aborted_connection_is_not_retried(event, payment, monkeypatch):
+    calls = []
+
+    def post(url, data=None, **kwargs):
+        # the request may have reached ifthenpay before the connection dropped
+        calls.append(url)
+        raise requests.ConnectionError(ProtocolError('Connection aborted.', RemoteDisconnected('closed')))
+
+    monkeypatch.setattr(mbway._SESSION, 'post', post)
+
+    require_mbway_payment.apply(args=(event.pk, payment.pk, '912345678')).get()
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_FAILED
+    assert len(calls) == 1
@@ -0,0 +1,90 @@
+import pytest
+
+from pretix.base.models import OrderPayment
+from pretix_mbway.ifthenpay import mbway
+from pretix_mbway.models import MBWAYIfThenPayObject
+from pretix_mbway.tasks import process_mbway_callback
+
+
+def _state_response(idpedido, estado):
+    return {'Estado': '000', 'EstadoPedidos': [{'IdPedido': idpedido, 'Estado': estado}]}
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(process_mbway_callback, 'apply_async', lambda args: calls.append(args))
+    return calls
+
+
+@pytest.mark.django_db
+def test_callback_missing_id(client, queued):
+    response = client.get('/_mbway/webhook/')
+    assert response.status_code == 400
+    assert queued == []
+
+
+@pytest.mark.django_db
+def test_callback_unknown_id(client, queued):
+    response = client.get('/_mbway/webhook/', {'idpedido': 'UNKNOWN'})
+    assert response.status_code == 404
+    assert queued == []
+
+
+@pytest.mark.django_db
+def test_callback_queues_known_id(client, queued, mbway_payment):
+    mbway_payment('P1')
+    response = client.get('/_mbway/webhook/', {'idpedido': 'P1'})
+    assert response.status_code == 200
+    assert queued == [('P1',)]
+
+
+@pytest.mark.django_db
+def test_process_callback_confirms_paid(ifthenpay, mbway_payment):
+    payment = mbway_payment('P1')
+    ifthenpay.responses.append(_state_response('P1', mbway.STATE_PAID))
+
+    process_mbway_callback('P1')
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+    assert ifthenpay.calls[0][1]['idspagamento'] == 'P1'
+
+
+@pytest.mark.django_db
+def test_process_callback_fails_cancelled(ifthenpay, mbway_payment):
+    payment = mbway_payment('P1')
+    ifthenpay.responses.append(_state_response('P1', mbway.STATE_CANCELLED))
+
+    process_mbway_callback('P1')
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_FAILED
+
+
+@pytest.mark.django_db
+def test_process_callback_skips_final_payment(ifthenpay, mbway_payment):
+    payment = mbway_payment('P1', state=OrderPayment.PAYMENT_STATE_CONFIRMED)
+
+    process_mbway_callback('P1')
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+    assert ifthenpay.calls == []
+
+
+@pytest.mark.django_db
+def test_process_callback_skips_locked_row(ifthenpay, mbway_payment, monkeypatch):
+    payment = mbway_payment('P1')
+
+    def locked(idpedido, lock=False):
+        # select_for_update(skip_locked=True) finds nothing while another delivery holds the row
+        raise MBWAYIfThenPayObject.DoesNotExist
+
+    monkeypatch.setattr(mbway, 'get_order_by_id', locked)
+
+    process_mbway_callback('P1')
+
+    payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_PENDING
+    assert ifthenpay.calls == []